@@ -1,34 +1,167 @@
-import os, sys, sqlite3, json, re, random
-from flask import Flask, request, jsonify, send_from_directory, redirect
+import os, sys, sqlite3, json, re, random, threading, itertools, hashlib, functools, mmap
+from array import array
+from flask import Flask, request, jsonify, send_from_directory, redirect, Response, stream_with_context, make_response
+from db import connect, full_text_sql
 
 app = Flask(__name__, static_folder="static")
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 DS9_IDS_PATH = os.path.join(os.path.dirname(__file__), "dataset9_ids.txt")
 
-# load dataset 9 IDs into memory
-DS9_IDS = []
-if os.path.exists(DS9_IDS_PATH):
-    with open(DS9_IDS_PATH) as f:
-        DS9_IDS = [line.strip() for line in f if line.strip()]
+def _index_lines(mm):
+    starts, ends = array("I"), array("I")
+    pos = 0
+    for line in iter(mm.readline, b""):
+        s = line.strip()
+        if s:
+            lead = len(line) - len(line.lstrip())
+            starts.append(pos + lead)
+            ends.append(pos + lead + len(s))
+        pos += len(line)
+    return starts, ends
+
+# dataset 9 IDs stay in the mmapped file, shared through the page cache by every
+# worker; only each ID's start/end offset is kept in memory
+DS9_MM = None
+DS9_STARTS, DS9_ENDS = array("I"), array("I")
+if os.path.exists(DS9_IDS_PATH) and os.path.getsize(DS9_IDS_PATH):
+    with open(DS9_IDS_PATH, "rb") as f:
+        DS9_MM = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    DS9_STARTS, DS9_ENDS = _index_lines(DS9_MM)
+
+def ds9_id(i):
+    return DS9_MM[DS9_STARTS[i]:DS9_ENDS[i]].decode()
+
+def ds9_matches(q):
+    # yields each ID containing q once, in file order, via C-level mmap.find
+    q = q.encode()
+    if DS9_MM is None or b"\n" in q:
+        return
+    pos = DS9_MM.find(q, 0)
+    while pos != -1:
+        start = DS9_MM.rfind(b"\n", 0, pos) + 1
+        end = DS9_MM.find(b"\n", pos)
+        if end == -1:
+            end = len(DS9_MM)
+        yield DS9_MM[start:end].strip().decode()
+        pos = DS9_MM.find(q, end + 1)
+
+# switch the db file to WAL once at startup so requests don't block batch
+# writers, and keep that connection open: when the last one closes sqlite
+# deletes -wal/-shm, and the first request recreating them would change
+# data_version() right after it was taken
+_wal_conn = connect(DB_PATH) if os.path.exists(DB_PATH) else None
+
+# one read-only connection per worker thread, reused across requests and
+# never closed, so requests skip the open + pragma setup and keep a warm cache
+_local = threading.local()
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = connect(DB_PATH, readonly=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        _local.conn = conn
     return conn
 
+def stream_json(items):
+    # write the JSON array item by item so large result sets never sit in memory
+    # as a row list + dict list + one big string
+    def generate():
+        yield "["
+        for i, item in enumerate(items):
+            yield ("," if i else "") + json.dumps(item, separators=(",", ":"))
+        yield "]"
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+def data_version():
+    # in WAL mode writes land in the -wal file until a checkpoint, so stat it
+    # alongside the db; returns (latest mtime, fingerprint of every file)
+    stats = [os.stat(p) for p in (DB_PATH, DB_PATH + "-wal", DS9_IDS_PATH) if os.path.exists(p)]
+    if not stats:
+        return None, None
+    return max(st.st_mtime for st in stats), tuple((st.st_mtime_ns, st.st_size) for st in stats)
+
+# endpoints registered by etag_cached; their responses may also be cached for
+# a minute by the browser
+CACHEABLE = set()
+
+def etag_cached(f):
+    # the data only changes when a batch script runs, so answer a matching
+    # If-None-Match with 304 from a stat() alone, before touching SQLite
+    CACHEABLE.add(f.__name__)
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        mtime, version = data_version()
+        if version is None:
+            return f(*args, **kwargs)
+        etag = hashlib.sha1(f"{request.full_path}:{version}".encode()).hexdigest()
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+        else:
+            resp = make_response(f(*args, **kwargs))
+        resp.set_etag(etag)
+        resp.last_modified = mtime
+        return resp
+    return wrapper
+
+@app.after_request
+def cache_headers(resp):
+    if request.endpoint in CACHEABLE and resp.status_code in (200, 304):
+        resp.headers["Cache-Control"] = "public, max-age=60"
+    return resp
+
+# the cached query functions below take the data_version() fingerprint as their
+# argument, so a batch run changes the key and stale entries age out of the LRU;
+# they return the serialized body so a hit skips the JSON encoding too
+def json_body(data):
+    return json.dumps(data, separators=(",", ":"))
+
+@functools.lru_cache(maxsize=8)
+def _stats(version):
+    conn = get_db()
+    docs = conn.execute("SELECT COUNT(*) c FROM documents").fetchone()["c"]
+    pages = conn.execute("SELECT COUNT(*) c FROM pages").fetchone()["c"]
+    return json_body({"documents": docs, "pages": pages})
+
+def page_args():
+    # optional ?limit=&offset= paging; SQLite treats LIMIT -1 as no limit
+    return int(request.args.get("limit", -1)), int(request.args.get("offset", 0))
+
+@functools.lru_cache(maxsize=8)
+def _highlights(version, limit, offset):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.row_factory = None
+    rows = cur.execute(f"""
+        SELECT d.id, d.filename, d.page_count, d.doc_type, d.interest_score,
+               COALESCE(d.ai_summary, substr(COALESCE(d.condensed, {full_text_sql("d")}), 1, 300)),
+               COALESCE(d.news_score, 0), COALESCE(d.news_reason, '')
+        FROM documents d
+        WHERE d.interest_score >= 40
+        ORDER BY COALESCE(d.news_score, 0) DESC, d.interest_score DESC
+        LIMIT ? OFFSET ?
+    """, (limit, offset))
+    return json_body([{"id": r[0], "filename": r[1], "page_count": r[2], "doc_type": r[3],
+                       "interest_score": r[4], "preview": r[5],
+                       "news_score": r[6], "news_reason": r[7]} for r in rows])
+
+@functools.lru_cache(maxsize=8)
+def _doc_types(version):
+    conn = get_db()
+    rows = conn.execute("SELECT doc_type, COUNT(*) c FROM documents GROUP BY doc_type ORDER BY c DESC")
+    return json_body([dict(r) for r in rows])
+
 @app.route("/")
 def index():
     return send_from_directory("static", "index.html")
 
 @app.route("/api/stats")
+@etag_cached
 def stats():
-    conn = get_db()
-    docs = conn.execute("SELECT COUNT(*) c FROM documents").fetchone()["c"]
-    pages = conn.execute("SELECT COUNT(*) c FROM pages").fetchone()["c"]
-    conn.close()
-    return jsonify({"documents": docs, "pages": pages})
+    return Response(_stats(data_version()[1]), mimetype="application/json")
 
 @app.route("/api/documents")
+@etag_cached
 def documents():
     conn = get_db()
     doc_type = request.args.get("type", "")
@@ -38,35 +171,20 @@ def documents():
     if doc_type:
         q += " AND doc_type = ?"
         params.append(doc_type)
-    q += " ORDER BY interest_score DESC, filename"
-    rows = conn.execute(q, params).fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in rows])
+    q += " ORDER BY interest_score DESC, filename LIMIT ? OFFSET ?"
+    params.extend(page_args())
+    rows = conn.execute(q, params)
+    return stream_json(dict(r) for r in rows)
 
 @app.route("/api/highlights")
+@etag_cached
 def highlights():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.row_factory = None
-    rows = cur.execute("""
-        SELECT d.id, d.filename, d.page_count, d.doc_type, d.interest_score,
-               COALESCE(d.ai_summary, substr(COALESCE(d.condensed, d.full_text), 1, 300)),
-               COALESCE(d.news_score, 0), COALESCE(d.news_reason, '')
-        FROM documents d
-        WHERE d.interest_score >= 40
-        ORDER BY COALESCE(d.news_score, 0) DESC, d.interest_score DESC
-    """).fetchall()
-    conn.close()
-    return jsonify([{"id": r[0], "filename": r[1], "page_count": r[2], "doc_type": r[3],
-                     "interest_score": r[4], "preview": r[5],
-                     "news_score": r[6], "news_reason": r[7]} for r in rows])
+    return Response(_highlights(data_version()[1], *page_args()), mimetype="application/json")
 
 @app.route("/api/doc_types")
+@etag_cached
 def doc_types():
-    conn = get_db()
-    rows = conn.execute("SELECT doc_type, COUNT(*) c FROM documents GROUP BY doc_type ORDER BY c DESC").fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in rows])
+    return Response(_doc_types(data_version()[1]), mimetype="application/json")
 
 @app.route("/api/document/<int:doc_id>")
 def document(doc_id):
@@ -75,19 +193,24 @@ def document(doc_id):
     if not doc:
         return jsonify({"error": "not found"}), 404
     pages = conn.execute("SELECT page_num, text FROM pages WHERE doc_id=? ORDER BY page_num", (doc_id,)).fetchall()
-    conn.close()
     d = dict(doc)
     d["condensed"] = d.get("condensed", "") or ""
     return jsonify({"doc": d, "pages": [dict(p) for p in pages]})
 
-def _build_fts_query(q):
+def _build_fts_queries(q):
     tokens = q.split()
     parts = []
     for t in tokens:
         clean = re.sub(r'[^\w]', '', t)
         if clean:
             parts.append(clean + "*")
-    return " AND ".join(parts)
+    if not parts:
+        return []
+    # strictest first: every token, then any token (still served by the index)
+    queries = [" AND ".join(parts)]
+    if len(parts) > 1:
+        queries.append(" OR ".join(parts))
+    return queries
 
 @app.route("/api/search")
 def search():
@@ -98,36 +221,37 @@ def search():
     cur = conn.cursor()
     cur.row_factory = None
 
-    # try FTS prefix match first
-    fts_q = _build_fts_query(q)
+    # try FTS prefix match first, loosening until something hits
     rows = []
-    if fts_q:
+    for fts_q in _build_fts_queries(q):
         try:
+            # rank inside the FTS table alone so its top-k early exit applies,
+            # then join pages/documents against the 100 candidates
             rows = cur.execute("""
-                SELECT p.doc_id, s.filename, p.page_num,
-                       snippet(search, 2, '<mark>', '</mark>', '...', 40)
-                FROM search s
+                SELECT p.doc_id, d.filename, p.page_num, s.snippet
+                FROM (SELECT rowid, rank, snippet(search, 0, '<mark>', '</mark>', '...', 40) snippet
+                      FROM search WHERE search MATCH ? ORDER BY rank LIMIT 100) s
                 JOIN pages p ON p.id = s.rowid
-                WHERE search MATCH ?
-                ORDER BY rank
-                LIMIT 100
+                JOIN documents d ON d.id = p.doc_id
+                ORDER BY s.rank
             """, (fts_q,)).fetchall()
         except Exception:
             rows = []
+        if rows:
+            break
 
-    # fallback: LIKE-based fuzzy search
+    # last resort: LIKE-based fuzzy search (full scan, so capped to scored docs)
     if not rows:
         like_pattern = "%" + "%".join(q.split()) + "%"
         rows = cur.execute("""
             SELECT p.doc_id, d.filename, p.page_num, substr(p.text, max(1, instr(lower(p.text), lower(?)) - 80), 200)
             FROM pages p
             JOIN documents d ON d.id = p.doc_id
-            WHERE lower(p.text) LIKE lower(?)
+            WHERE d.interest_score >= 20 AND lower(p.text) LIKE lower(?)
             ORDER BY p.doc_id, p.page_num
             LIMIT 100
         """, (q.split()[0], like_pattern)).fetchall()
 
-    conn.close()
     return jsonify([{"doc_id": r[0], "filename": r[1], "page_num": r[2], "snippet": r[3]} for r in rows])
 
 @app.route("/api/summarize", methods=["POST"])
@@ -162,7 +286,6 @@ def summarize():
 def serve_pdf(doc_id):
     conn = get_db()
     doc = conn.execute("SELECT filepath FROM documents WHERE id=?", (doc_id,)).fetchone()
-    conn.close()
     if not doc:
         return "not found", 404
     from flask import send_file
@@ -174,23 +297,24 @@ def browser():
 
 @app.route("/api/ds9/random")
 def ds9_random():
-    if not DS9_IDS:
+    if not DS9_STARTS:
         return jsonify({"error": "Dataset 9 IDs not loaded"}), 500
-    file_id = random.choice(DS9_IDS)
+    file_id = ds9_id(random.randrange(len(DS9_STARTS)))
     url = f"https://www.justice.gov/epstein/files/DataSet%209/{file_id}.pdf"
     return jsonify({"id": file_id, "url": url})
 
 @app.route("/api/ds9/stats")
+@etag_cached
 def ds9_stats():
-    return jsonify({"count": len(DS9_IDS), "sample": DS9_IDS[:10] if DS9_IDS else []})
+    return jsonify({"count": len(DS9_STARTS), "sample": [ds9_id(i) for i in range(min(10, len(DS9_STARTS)))]})
 
 @app.route("/api/ds9/search")
 def ds9_search():
     q = request.args.get("q", "").strip().upper()
     if not q:
         return jsonify([])
-    matches = [fid for fid in DS9_IDS if q in fid][:100]
-    return jsonify([{"id": fid, "url": f"https://www.justice.gov/epstein/files/DataSet%209/{fid}.pdf"} for fid in matches])
+    matches = itertools.islice(ds9_matches(q), 100)
+    return stream_json({"id": fid, "url": f"https://www.justice.gov/epstein/files/DataSet%209/{fid}.pdf"} for fid in matches)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8001, debug=False)
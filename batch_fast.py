@@ -1,4 +1,6 @@
-import sqlite3, json, os, urllib.request, concurrent.futures, time
+import json, os, concurrent.futures, time
+from db import connect, full_text_sql, create_newsworthy_index
+from gemini import post_json
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 API_KEY = os.environ.get("GEMINI_API_KEY")
@@ -30,15 +32,13 @@ Summary:
 """
 
 def call_gemini(prompt, max_tokens=512):
-    payload = json.dumps({
+    payload = {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {"temperature": 0.2, "maxOutputTokens": max_tokens}
-    })
-    req = urllib.request.Request(URL, data=payload.encode(), headers={"Content-Type": "application/json"})
+    }
     for attempt in range(3):
         try:
-            resp = urllib.request.urlopen(req, timeout=30)
-            result = json.loads(resp.read())
+            result = post_json(URL, payload, timeout=30)
             return result["candidates"][0]["content"]["parts"][0]["text"]
         except Exception as e:
             if "429" in str(e) or "quota" in str(e).lower():
@@ -47,6 +47,15 @@ def call_gemini(prompt, max_tokens=512):
                 time.sleep(2)
     return None
 
+# commit completed results in groups rather than once per API response
+COMMIT_EVERY = 16
+
+def flush_updates(conn, sql, pending):
+    if pending:
+        conn.executemany(sql, pending)
+        conn.commit()
+        pending.clear()
+
 def summarize_doc(row):
     doc_id, fname, condensed, full_text = row
     text = condensed if condensed and len(condensed) > 50 else full_text
@@ -80,7 +89,7 @@ def main():
         print("ERROR: GEMINI_API_KEY not set")
         return
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
     try:
         conn.execute("ALTER TABLE documents ADD COLUMN ai_summary TEXT DEFAULT ''")
     except:
@@ -93,10 +102,13 @@ def main():
         conn.execute("ALTER TABLE documents ADD COLUMN news_reason TEXT DEFAULT ''")
     except:
         pass
+    # matches /api/highlights' ORDER BY expression so it needs no sort step
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_news ON documents(COALESCE(news_score, 0) DESC, interest_score DESC)")
+    create_newsworthy_index(conn)
 
     # get unsummarized docs
-    remaining = conn.execute("""
-        SELECT id, filename, condensed, full_text
+    remaining = conn.execute(f"""
+        SELECT id, filename, condensed, {full_text_sql()}
         FROM documents WHERE interest_score >= 40 AND (ai_summary IS NULL OR ai_summary = '')
         ORDER BY interest_score DESC
     """).fetchall()
@@ -113,15 +125,20 @@ def main():
     # summarize remaining (5 concurrent to stay under rate limits)
     if remaining:
         print("\n--- Summarizing ---")
+        sql = "UPDATE documents SET ai_summary=?, news_score=?, news_reason=? WHERE id=?"
+        pending = []
         with concurrent.futures.ThreadPoolExecutor(max_workers=5) as pool:
             futures = {pool.submit(summarize_doc, row): row for row in remaining}
-            for i, future in enumerate(concurrent.futures.as_completed(futures)):
-                doc_id, fname, summary, news_score, reason = future.result()
-                if summary:
-                    conn.execute("UPDATE documents SET ai_summary=?, news_score=?, news_reason=? WHERE id=?",
-                                 (summary, news_score, reason, doc_id))
-                    conn.commit()
-                    print(f"  [{i+1}/{len(remaining)}] {fname} (news:{news_score})")
+            try:
+                for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                    doc_id, fname, summary, news_score, reason = future.result()
+                    if summary:
+                        pending.append((summary, news_score, reason, doc_id))
+                        print(f"  [{i+1}/{len(remaining)}] {fname} (news:{news_score})")
+                    if len(pending) >= COMMIT_EVERY:
+                        flush_updates(conn, sql, pending)
+            finally:
+                flush_updates(conn, sql, pending)
 
     # rank already-summarized docs
     if unranked:
@@ -142,14 +159,19 @@ def main():
                     pass
             return doc_id, fname, score, reason
 
+        sql = "UPDATE documents SET news_score=?, news_reason=? WHERE id=?"
+        pending = []
         with concurrent.futures.ThreadPoolExecutor(max_workers=5) as pool:
             futures = {pool.submit(rank_existing, row): row for row in unranked}
-            for i, future in enumerate(concurrent.futures.as_completed(futures)):
-                doc_id, fname, score, reason = future.result()
-                conn.execute("UPDATE documents SET news_score=?, news_reason=? WHERE id=?",
-                             (score, reason, doc_id))
-                conn.commit()
-                print(f"  [{i+1}/{len(unranked)}] {fname} (news:{score})")
+            try:
+                for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                    doc_id, fname, score, reason = future.result()
+                    pending.append((score, reason, doc_id))
+                    print(f"  [{i+1}/{len(unranked)}] {fname} (news:{score})")
+                    if len(pending) >= COMMIT_EVERY:
+                        flush_updates(conn, sql, pending)
+            finally:
+                flush_updates(conn, sql, pending)
 
     # final stats
     print("\n--- Top 15 most newsworthy ---")
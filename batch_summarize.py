@@ -1,4 +1,6 @@
-import sqlite3, json, os, time, urllib.request
+import os, time
+from db import connect, full_text_sql
+from gemini import post_json
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 API_KEY = os.environ.get("GEMINI_API_KEY")
@@ -18,13 +20,11 @@ Document text:
 """
 
 def summarize(text):
-    payload = json.dumps({
+    payload = {
         "contents": [{"parts": [{"text": PROMPT + text[:7000]}]}],
         "generationConfig": {"temperature": 0.2, "maxOutputTokens": 512}
-    })
-    req = urllib.request.Request(URL, data=payload.encode(), headers={"Content-Type": "application/json"})
-    resp = urllib.request.urlopen(req)
-    result = json.loads(resp.read())
+    }
+    result = post_json(URL, payload)
     return result["candidates"][0]["content"]["parts"][0]["text"]
 
 def main():
@@ -32,14 +32,14 @@ def main():
         print("ERROR: GEMINI_API_KEY not set. Run: source ~/.zshrc")
         return
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
     try:
         conn.execute("ALTER TABLE documents ADD COLUMN ai_summary TEXT DEFAULT ''")
     except:
         pass
 
-    rows = conn.execute("""
-        SELECT id, filename, condensed, full_text
+    rows = conn.execute(f"""
+        SELECT id, filename, condensed, {full_text_sql()}
         FROM documents
         WHERE interest_score >= 40 AND (ai_summary IS NULL OR ai_summary = '')
         ORDER BY interest_score DESC
@@ -1,7 +1,37 @@
-import sqlite3, re, os
+import re, os
+from concurrent.futures import ProcessPoolExecutor
+from db import connect, full_text_sql
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 
+RE_EMAIL = re.compile(r'^(from:|sent:|to:|subject:|date:)', re.MULTILINE)
+RE_DEPOSITION = re.compile(r'\b(deposition|testimony|grand jury|Q\.\s|A\.\s|WITNESS|sworn)')
+RE_LAW_ENFORCEMENT = re.compile(r'\b(fbi|case number|case summary|investigation|indicted|arrest|convicted|bureau)')
+RE_LEGAL = re.compile(r'\b(court|motion|order|plaintiff|defendant|docket|filed|judge|verdict|sentence)')
+RE_PHONE = re.compile(r'(fax activity|call detail|call log|phone.*record)')
+EVIDENCE_TERMS = ('evidence', 'property', 'contents', 'item quantity')
+
+KEY_NAMES = ('epstein', 'maxwell', 'ghislaine', 'prince andrew', 'giuffre', 'roberts',
+             'dershowitz', 'clinton', 'trump', 'black', 'wexner', 'brunel', 'dubin')
+
+# bytes.translate drops these in one C call, so ASCII text is counted without a
+# per-character Python loop; only non-ASCII runs fall back to str.isalpha/isdigit
+ASCII_NON_ALPHA = bytes(b for b in range(128) if not chr(b).isalpha())
+ASCII_NON_DIGIT = bytes(b for b in range(128) if not chr(b).isdigit())
+RE_NON_ASCII = re.compile(r'[^\x00-\x7f]+')
+
+def count_letters(s):
+    n = len(s.encode("ascii", "ignore").translate(None, ASCII_NON_ALPHA))
+    if not s.isascii():
+        n += sum(1 for c in "".join(RE_NON_ASCII.findall(s)) if c.isalpha())
+    return n
+
+def count_digits(s):
+    n = len(s.encode("ascii", "ignore").translate(None, ASCII_NON_DIGIT))
+    if not s.isascii():
+        n += sum(1 for c in "".join(RE_NON_ASCII.findall(s)) if c.isdigit())
+    return n
+
 def classify(text, page_count):
     text = text or ""
     stripped = text.strip()
@@ -12,7 +42,7 @@ def classify(text, page_count):
         return "empty", 0
 
     # OCR garbage: high ratio of symbols/punctuation to letters
-    letters = sum(1 for c in stripped if c.isalpha())
+    letters = count_letters(stripped)
     if char_count > 0 and letters / char_count < 0.3:
         return "scan_garbage", 0
 
@@ -23,27 +53,27 @@ def classify(text, page_count):
     doc_type = "other"
 
     # emails / memos
-    if re.search(r'^(from:|sent:|to:|subject:|date:)', lower, re.MULTILINE):
+    if RE_EMAIL.search(lower):
         doc_type = "email"
         score = 60
 
     # depositions / testimony
-    if re.search(r'\b(deposition|testimony|grand jury|Q\.\s|A\.\s|WITNESS|sworn)', lower):
+    if RE_DEPOSITION.search(lower):
         doc_type = "deposition" if doc_type == "other" else doc_type
         score = max(score, 70)
 
     # FBI / law enforcement reports
-    if re.search(r'\b(fbi|case number|case summary|investigation|indicted|arrest|convicted|bureau)', lower):
+    if RE_LAW_ENFORCEMENT.search(lower):
         doc_type = "law_enforcement"
         score = max(score, 80)
 
     # legal filings
-    if re.search(r'\b(court|motion|order|plaintiff|defendant|docket|filed|judge|verdict|sentence)', lower):
+    if RE_LEGAL.search(lower):
         doc_type = "legal" if doc_type == "other" else doc_type
         score = max(score, 50)
 
     # phone/fax logs
-    if re.search(r'(fax activity|call detail|call log|phone.*record)', lower):
+    if RE_PHONE.search(lower):
         doc_type = "phone_records"
         score = 20
 
@@ -53,14 +83,12 @@ def classify(text, page_count):
         score = 10
 
     # evidence/property lists
-    if re.search(r'(evidence|property|contents|item quantity)', lower):
+    if any(t in lower for t in EVIDENCE_TERMS):
         doc_type = "evidence_list"
         score = 30
 
     # boost for key names
-    names = ['epstein', 'maxwell', 'ghislaine', 'prince andrew', 'giuffre', 'roberts',
-             'dershowitz', 'clinton', 'trump', 'black', 'wexner', 'brunel', 'dubin']
-    name_hits = sum(1 for n in names if n in lower)
+    name_hits = sum(1 for n in KEY_NAMES if n in lower)
     score += name_hits * 10
 
     # boost for substantive content length
@@ -79,8 +107,13 @@ def classify(text, page_count):
 
     return doc_type, score
 
+def classify_row(row):
+    doc_id, text, page_count = row
+    doc_type, score = classify(text, page_count)
+    return doc_type, score, doc_id
+
 def main():
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
 
     # add columns if not exist
     try:
@@ -91,17 +124,23 @@ def main():
         conn.execute("ALTER TABLE documents ADD COLUMN interest_score INTEGER DEFAULT 0")
     except:
         pass
+    # serve /api/documents' ORDER BY straight from an index, with or without a type filter
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_score ON documents(interest_score DESC, filename)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_score_type ON documents(doc_type, interest_score DESC, filename)")
 
-    rows = conn.execute("SELECT id, full_text, page_count FROM documents").fetchall()
+    rows = conn.execute(f"SELECT id, {full_text_sql()}, page_count FROM documents").fetchall()
     print(f"Classifying {len(rows)} documents...")
 
+    # pure-Python CPU work, so spread it across processes rather than threads
+    with ProcessPoolExecutor() as ex:
+        results = list(ex.map(classify_row, rows, chunksize=128))
+
     counts = {}
-    for doc_id, text, page_count in rows:
-        doc_type, score = classify(text, page_count)
-        conn.execute("UPDATE documents SET doc_type=?, interest_score=? WHERE id=?", (doc_type, score, doc_id))
+    for doc_type, score, doc_id in results:
         counts[doc_type] = counts.get(doc_type, 0) + 1
 
-    conn.commit()
+    with conn:
+        conn.executemany("UPDATE documents SET doc_type=?, interest_score=? WHERE id=?", results)
 
     print("\nDocument types:")
     for dtype, count in sorted(counts.items(), key=lambda x: -x[1]):
@@ -111,7 +150,7 @@ def main():
     print(f"\n{interesting} documents with interest score >= 40 (out of {len(rows)})")
 
     print("\nTop 10 most interesting:")
-    top = conn.execute("SELECT filename, doc_type, interest_score, substr(full_text, 1, 120) FROM documents ORDER BY interest_score DESC LIMIT 10").fetchall()
+    top = conn.execute(f"SELECT filename, doc_type, interest_score, substr({full_text_sql()}, 1, 120) FROM documents ORDER BY interest_score DESC LIMIT 10").fetchall()
     for fname, dtype, score, preview in top:
         print(f"  [{score}] {fname} ({dtype}) — {preview[:80]}...")
 
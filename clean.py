@@ -1,7 +1,12 @@
-import re, sqlite3, os
+import re, os
+from db import connect
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 
+RE_PAGEHDR = re.compile(r'^Page \d+ of \d+')
+RE_BLANKS = re.compile(r'\n{3,}')
+RE_BROKEN_LINE = re.compile(r'(?<=[a-z,])\n(?=[a-z])')
+
 def clean_text(text):
     if not text or len(text.strip()) < 10:
         return text
@@ -12,14 +17,15 @@ def clean_text(text):
         s = line.strip()
         if not s:
             continue
-        # skip standalone line numbers (deposition format)
-        if re.match(r'^\d{1,3}$', s):
+        # skip standalone line numbers (deposition format); isdecimal() is
+        # exactly regex \d, so the cheap string checks run before any regex
+        if len(s) <= 3 and s.isdecimal():
             continue
         # skip bates stamps
-        if re.match(r'^EFTA\d+$', s):
+        if s.startswith("EFTA") and s[4:].isdecimal():
             continue
         # skip page headers like "Page X of Y"
-        if re.match(r'^Page \d+ of \d+', s):
+        if s.startswith("Page ") and RE_PAGEHDR.match(s):
             continue
         # skip "ITEM WAS NOT SCANNED" artifacts
         if 'WAS NOT SCANNED' in s.upper():
@@ -29,43 +35,40 @@ def clean_text(text):
     text = "\n".join(cleaned)
 
     # collapse excessive whitespace / newlines
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = RE_BLANKS.sub('\n\n', text)
     # rejoin lines that are broken mid-sentence (lowercase continuation)
-    text = re.sub(r'(?<=[a-z,])\n(?=[a-z])', ' ', text)
+    text = RE_BROKEN_LINE.sub(' ', text)
 
     return text.strip()
 
 def main():
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
     rows = conn.execute("SELECT id, text FROM pages").fetchall()
     print(f"Cleaning {len(rows)} pages...")
 
-    updated = 0
-    for row_id, text in rows:
-        cleaned = clean_text(text)
-        if cleaned != text:
-            conn.execute("UPDATE pages SET text=? WHERE id=?", (cleaned, row_id))
-            updated += 1
-
-    conn.commit()
+    # single transaction for the page rewrite and FTS rebuild
+    with conn:
+        changed = []
+        for row_id, text in rows:
+            cleaned = clean_text(text)
+            if cleaned != text:
+                changed.append((cleaned, row_id))
+        conn.executemany("UPDATE pages SET text=? WHERE id=?", changed)
+        updated = len(changed)
 
-    # also update full_text on documents
-    docs = conn.execute("SELECT id FROM documents").fetchall()
-    for (doc_id,) in docs:
-        pages = conn.execute("SELECT text FROM pages WHERE doc_id=? ORDER BY page_num", (doc_id,)).fetchall()
-        full = "\n\n".join(p[0] for p in pages)
-        conn.execute("UPDATE documents SET full_text=? WHERE id=?", (full, doc_id))
-    conn.commit()
+        # full_text is rebuilt from pages on read now (db.full_text_sql), so
+        # drop the stored copy left over in dbs built before that
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_doc ON pages(doc_id, page_num)")
+        if "full_text" in [col[1] for col in conn.execute("PRAGMA table_info(documents)")]:
+            conn.execute("ALTER TABLE documents DROP COLUMN full_text")
 
-    # rebuild FTS index
-    conn.execute("DROP TABLE IF EXISTS search")
-    conn.execute("CREATE VIRTUAL TABLE search USING fts5(filename, page_num, text)")
-    idx_rows = conn.execute("SELECT p.id, d.filename, p.page_num, p.text FROM pages p JOIN documents d ON d.id = p.doc_id").fetchall()
-    for r in idx_rows:
-        conn.execute("INSERT INTO search(rowid, filename, page_num, text) VALUES (?,?,?,?)", r)
-    conn.commit()
+        # rebuild FTS index in one pass over pages (external content, so the
+        # page text isn't stored a second time)
+        conn.execute("DROP TABLE IF EXISTS search")
+        conn.execute("CREATE VIRTUAL TABLE search USING fts5(text, content='pages', content_rowid='id')")
+        conn.execute("INSERT INTO search(search) VALUES('rebuild')")
 
-    print(f"Updated {updated} pages, rebuilt search index ({len(idx_rows)} rows)")
+    print(f"Updated {updated} pages, rebuilt search index ({len(rows)} rows)")
     conn.close()
 
 if __name__ == "__main__":
@@ -1,44 +1,62 @@
-import sqlite3, re, os
+import re, os
+from concurrent.futures import ProcessPoolExecutor
+from db import connect, full_text_sql
+from classify import count_letters, count_digits
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 
-# boilerplate patterns to strip
+# boilerplate patterns to strip, each with the lowercase literals at least one
+# of which must appear in the page for it to match (None = always run)
 JUNK_PATTERNS = [
     # evidence envelope / chain of custody
-    r'(?i)chain of custody.*?(?=\n\n|\Z)',
-    r'(?i)evidence envelope.*?(?=\n\n|\Z)',
-    r'(?i)enclosure:.*?(?=\n\n|\Z)',
-    r'(?i)(?:original|duplicate|enhanced original)\s*$',
-    r'(?i)magnetic tape.*?computer disk.*?printed material',
-    r'(?i)court authorized intercept.*?(?=\n\n|\Z)',
+    (("chain of custody",), r'(?i)chain of custody.*?(?=\n\n|\Z)'),
+    (("evidence envelope",), r'(?i)evidence envelope.*?(?=\n\n|\Z)'),
+    (("enclosure:",), r'(?i)enclosure:.*?(?=\n\n|\Z)'),
+    (("original", "duplicate"), r'(?i)(?:original|duplicate|enhanced original)\s*$'),
+    (("magnetic tape",), r'(?i)magnetic tape.*?computer disk.*?printed material'),
+    (("court authorized intercept",), r'(?i)court authorized intercept.*?(?=\n\n|\Z)'),
     # email boilerplate
-    r'(?i)please consider the environment before printing.*',
-    r'(?i)this communication may contain confidential.*?(?=\n\n|\Z)',
-    r'(?i)this e-?mail (?:and any|is|may).*?(?=\n\n|\Z)',
-    r'(?i)if you (?:are not|have received) the intended recipient.*?(?=\n\n|\Z)',
-    r'(?i)disclaimer:.*?(?=\n\n|\Z)',
-    r'(?i)privileged.*?attorney.*?client.*?(?=\n\n|\Z)',
+    (("please consider the environment",), r'(?i)please consider the environment before printing.*'),
+    (("this communication may contain",), r'(?i)this communication may contain confidential.*?(?=\n\n|\Z)'),
+    (("this e",), r'(?i)this e-?mail (?:and any|is|may).*?(?=\n\n|\Z)'),
+    (("the intended recipient",), r'(?i)if you (?:are not|have received) the intended recipient.*?(?=\n\n|\Z)'),
+    (("disclaimer:",), r'(?i)disclaimer:.*?(?=\n\n|\Z)'),
+    (("privileged",), r'(?i)privileged.*?attorney.*?client.*?(?=\n\n|\Z)'),
     # scan artifacts
-    r'(?i)item\s+was\s+not\s+scanned\s+description',
+    (("item",), r'(?i)item\s+was\s+not\s+scanned\s+description'),
     # page headers/footers
-    r'(?i)grand jury material.*?criminal procedure',
-    r'(?i)this document contains neither recommendations nor conclusions of the fbi.*?(?=\n\n|\Z)',
-    r'(?i)it is the property of the fbi.*?(?=\n\n|\Z)',
+    (("grand jury material",), r'(?i)grand jury material.*?criminal procedure'),
+    (("this document contains neither",), r'(?i)this document contains neither recommendations nor conclusions of the fbi.*?(?=\n\n|\Z)'),
+    (("it is the property of the fbi",), r'(?i)it is the property of the fbi.*?(?=\n\n|\Z)'),
     # repeated exhibit stamps
-    r'(?:GM_[A-Z]+_\d+\s*)+',
+    (("gm_",), r'(?:GM_[A-Z]+_\d+\s*)+'),
     # image file listings
-    r'(?:[A-Z]+\d+[._]\w+\s*){3,}',
+    (None, r'(?:[A-Z]+\d+[._]\w+\s*){3,}'),
 ]
+JUNK_RES = [(triggers, re.compile(p, re.MULTILINE | re.DOTALL)) for triggers, p in JUNK_PATTERNS]
+
+RE_BLANKS = re.compile(r'\n{3,}')
+RE_QA = re.compile(r'\b[QA]\.\s')
+RE_SENTENCE = re.compile(r'[.!?]\s+[A-Z]')
+RE_EMAIL_HEADER = re.compile(r'^(From:|Subject:)', re.MULTILINE)
+
+# plain literals matched against the lowered text: a handful of substring scans
+# beats a regex alternation (which retries every branch at every offset)
+KEY_NAMES = ('epstein', 'maxwell', 'ghislaine', 'prince andrew', 'giuffre', 'roberts',
+             'dershowitz', 'clinton', 'trump', 'black', 'wexner', 'brunel', 'dubin',
+             'victim', 'minor', 'underage', 'abuse', 'trafficking')
+INVESTIGATION_TERMS = ('investigation', 'arrest', 'surveillance', 'interview', 'witness', 'statement', 'allegation')
+LEGAL_TERMS = ('plea agreement', 'indictment', 'non-prosecution', 'immunity', 'cooperat', 'sentenc')
 
 def is_junk_page(text):
     s = text.strip()
     if len(s) < 15:
         return True
-    letters = sum(1 for c in s if c.isalpha())
+    letters = count_letters(s)
     if len(s) > 0 and letters / len(s) < 0.25:
         return True
     # page is just phone records (mostly digits/dates)
-    digits = sum(1 for c in s if c.isdigit())
+    digits = count_digits(s)
     if len(s) > 50 and digits / len(s) > 0.4:
         return True
     return False
@@ -52,11 +70,18 @@ def condense_text(full_text):
     for page in pages:
         if is_junk_page(page):
             continue
+        # a substring check is far cheaper than a regex pass, so only run the
+        # patterns whose literals are present (re-lowered after each removal)
         cleaned = page
-        for pat in JUNK_PATTERNS:
-            cleaned = re.sub(pat, '', cleaned, flags=re.MULTILINE | re.DOTALL)
+        lower = page.lower()
+        for triggers, pat in JUNK_RES:
+            if triggers and not any(t in lower for t in triggers):
+                continue
+            cleaned, n = pat.subn('', cleaned)
+            if n:
+                lower = cleaned.lower()
         # collapse whitespace
-        cleaned = re.sub(r'\n{3,}', '\n\n', cleaned).strip()
+        cleaned = RE_BLANKS.sub('\n\n', cleaned).strip()
         if len(cleaned) > 15:
             kept.append(cleaned)
     return "\n\n".join(kept)
@@ -66,85 +91,91 @@ def reclassify(text, condensed, doc_type, page_count):
         return "empty", 0
 
     lower = condensed.lower()
+    char_count = len(condensed)
     score = 0
 
     # substantive content markers
     has_names = False
-    key_names = ['epstein', 'maxwell', 'ghislaine', 'prince andrew', 'giuffre', 'roberts',
-                 'dershowitz', 'clinton', 'trump', 'black', 'wexner', 'brunel', 'dubin',
-                 'victim', 'minor', 'underage', 'abuse', 'trafficking']
-    name_hits = sum(1 for n in key_names if n in lower)
+    name_hits = sum(1 for n in KEY_NAMES if n in lower)
     if name_hits:
         has_names = True
         score += name_hits * 8
 
     # dialogue/testimony (Q&A format)
-    qa_count = len(re.findall(r'\b[QA]\.\s', condensed))
+    qa_count = len(RE_QA.findall(condensed))
     if qa_count > 5:
         doc_type = "deposition"
         score += 30
 
     # narrative content (sentences, not just data)
-    sentences = len(re.findall(r'[.!?]\s+[A-Z]', condensed))
+    sentences = len(RE_SENTENCE.findall(condensed))
     if sentences > 5:
         score += 20
     elif sentences > 2:
         score += 10
 
     # FBI/law enforcement specifics
-    if re.search(r'(?i)(investigation|arrest|surveillance|interview|witness|statement|allegation)', lower):
+    if any(t in lower for t in INVESTIGATION_TERMS):
         score += 20
         if doc_type not in ('deposition', 'email'):
             doc_type = "law_enforcement"
 
     # legal substance
-    if re.search(r'(?i)(plea agreement|indictment|non-prosecution|immunity|cooperat|sentenc)', lower):
+    if any(t in lower for t in LEGAL_TERMS):
         score += 25
 
     # emails with actual content (not just headers)
-    if re.search(r'^(From:|Subject:)', condensed, re.MULTILINE):
-        if sentences > 2 or len(condensed) > 300:
+    if RE_EMAIL_HEADER.search(condensed):
+        if sentences > 2 or char_count > 300:
             doc_type = "email"
             score += 15
 
     # demote if mostly tabular/data
     lines = condensed.split('\n')
+    line_count = len(lines)
     short_lines = sum(1 for l in lines if len(l.strip()) < 20)
-    if len(lines) > 10 and short_lines / len(lines) > 0.7:
+    if line_count > 10 and short_lines / line_count > 0.7:
         score = max(score - 20, 0)
 
     # length bonus
-    if len(condensed) > 2000:
+    if char_count > 2000:
         score += 10
-    if len(condensed) > 5000:
+    if char_count > 5000:
         score += 10
 
     score = min(score, 100)
     return doc_type, score
 
+def condense_row(row):
+    doc_id, full_text, doc_type, page_count = row
+    condensed = condense_text(full_text)
+    new_type, new_score = reclassify(full_text, condensed, doc_type, page_count)
+    return condensed, new_type, new_score, doc_id
+
 def main():
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
 
     try:
         conn.execute("ALTER TABLE documents ADD COLUMN condensed TEXT DEFAULT ''")
     except:
         pass
 
-    rows = conn.execute("SELECT id, full_text, doc_type, page_count FROM documents").fetchall()
+    rows = conn.execute(f"SELECT id, {full_text_sql()}, doc_type, page_count FROM documents").fetchall()
     print(f"Condensing {len(rows)} documents...")
 
+    # pure-Python CPU work, so spread it across processes rather than threads
+    with ProcessPoolExecutor() as ex:
+        results = list(ex.map(condense_row, rows, chunksize=128))
+
     stats = {"removed": 0, "kept": 0, "upgraded": 0, "downgraded": 0}
-    for doc_id, full_text, doc_type, page_count in rows:
-        condensed = condense_text(full_text)
-        new_type, new_score = reclassify(full_text, condensed, doc_type, page_count)
-        conn.execute("UPDATE documents SET condensed=?, doc_type=?, interest_score=? WHERE id=?",
-                     (condensed, new_type, new_score, doc_id))
+    for condensed, new_type, new_score, doc_id in results:
         if new_score < 40:
             stats["removed"] += 1
         else:
             stats["kept"] += 1
 
-    conn.commit()
+    with conn:
+        conn.executemany("UPDATE documents SET condensed=?, doc_type=?, interest_score=? WHERE id=?", results)
 
     total_highlights = conn.execute("SELECT COUNT(*) FROM documents WHERE interest_score >= 40").fetchone()[0]
     print(f"\nResults:")
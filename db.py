@@ -0,0 +1,73 @@
+import sqlite3, itertools, collections
+
+# applied on every new connection
+PRAGMAS = [
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+]
+
+def full_text_sql(table="documents"):
+    # a document's text isn't stored next to its pages any more; this rebuilds
+    # it from pages (in page order, blank line between pages) for a query
+    # that selects from `table`, using idx_pages_doc
+    return f"""COALESCE((SELECT group_concat(text, char(10) || char(10)) FROM
+        (SELECT text FROM pages WHERE doc_id = {table}.id ORDER BY page_num)), '')"""
+
+# the rows the report scripts read; idx_docs_newsworthy is a partial index on
+# exactly this predicate, which is what lets the planner use it
+NEWSWORTHY = "ai_summary != '' AND news_score >= 50"
+
+def create_newsworthy_index(conn):
+    # in (ai_summary, id) order, so the reports' GROUP BY needs no sort
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_docs_newsworthy ON documents(ai_summary) WHERE {NEWSWORTHY}")
+
+def newsworthy_batches(conn, batch_size):
+    # (document count, unique summary count, lazy batches) for the report
+    # scripts. Documents with identical summaries (duplicate filings, form
+    # letters) are one row, headed by all their filenames (in id order: the
+    # index, like a plain scan, yields each group's rows by rowid). Ordering
+    # by an aggregate means sqlite scans every matching row and sorts the
+    # groups in a temp b-tree before returning the first one
+    create_newsworthy_index(conn)  # batch_fast.py makes it; older dbs may lack it
+    total, unique = conn.execute(
+        f"SELECT COUNT(*), COUNT(DISTINCT ai_summary) FROM documents WHERE {NEWSWORTHY}").fetchone()
+    cur = conn.execute(f"""
+        SELECT group_concat(filename, ', '), MAX(news_score), ai_summary
+        FROM documents WHERE {NEWSWORTHY}
+        GROUP BY ai_summary
+        ORDER BY MAX(news_score) DESC, MIN(id)
+    """)
+    return total, unique, chunked(cur, batch_size)
+
+def connect(path, readonly=False, **kwargs):
+    if readonly:
+        conn = sqlite3.connect(f"file:{path}?mode=ro&cache=private", uri=True, **kwargs)
+    else:
+        conn = sqlite3.connect(path, **kwargs)
+        # persists on the db file so readers (app.py) don't block the batch
+        # scripts writing to it; a read-only connection can't switch modes
+        conn.execute("PRAGMA journal_mode=WAL")
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def chunked(rows, n):
+    # lists of up to n rows, pulled lazily from a cursor (or any iterable)
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, n)):
+        yield chunk
+
+def map_in_order(ex, fn, items, window):
+    # like ex.map, which submits every item up front, but keeps at most
+    # `window` submitted and unread, so items (e.g. chunked() cursor rows)
+    # are only pulled as results are consumed; results come back in order
+    pending = collections.deque()
+    for item in items:
+        pending.append(ex.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,239 @@
+import http.client, io, json, os, random, threading, time, hashlib, urllib.error, urllib.parse
+from db import connect
+
+# one kept-alive HTTPS connection per thread and host, so repeated API calls
+# skip the TCP + TLS handshake that urllib.request.urlopen pays every time
+_local = threading.local()
+
+def _connection(host, timeout):
+    conns = _local.__dict__.setdefault("conns", {})
+    conn = conns.get(host)
+    if conn is None:
+        conn = http.client.HTTPSConnection(host, timeout=timeout)
+        conns[host] = conn
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+    return conn
+
+def _drop(host):
+    conn = _local.__dict__.get("conns", {}).pop(host, None)
+    if conn is not None:
+        conn.close()
+
+def _post(url, payload, timeout):
+    # sends the POST and returns (host, response) with the body still unread;
+    # raises urllib.error.HTTPError on error statuses, like urlopen did, with
+    # the error body kept readable (Gemini's retry hints are in it)
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    body = json.dumps(payload).encode()
+    for attempt in range(2):
+        conn = _connection(parts.netloc, timeout)
+        try:
+            conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+            resp = conn.getresponse()
+        except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionError):
+            # the server closed an idle keep-alive connection; reconnect once
+            _drop(parts.netloc)
+            if attempt:
+                raise
+            continue
+        except Exception:
+            _drop(parts.netloc)
+            raise
+        if resp.status >= 400:
+            data = _finish(parts.netloc, resp)
+            raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+        return parts.netloc, resp
+
+def _finish(host, resp):
+    # read what's left so the connection can carry the next request
+    try:
+        data = resp.read()
+    except Exception:
+        _drop(host)
+        raise
+    if resp.will_close:
+        _drop(host)
+    return data
+
+def post_json(url, payload, timeout=None):
+    host, resp = _post(url, payload, timeout)
+    return json.loads(_finish(host, resp))
+
+def post_sse(url, payload, timeout=None):
+    # yields each server-sent event's JSON as it arrives (?alt=sse endpoints);
+    # the timeout applies per read, not to the whole stream
+    host, resp = _post(url, payload, timeout)
+    done = False
+    try:
+        for line in resp:
+            if line.startswith(b"data:"):
+                yield json.loads(line[5:])
+        # readline() never marks a Content-Length (unchunked) body finished,
+        # which would leave the connection refusing the next request
+        _finish(host, resp)
+        done = True
+    finally:
+        # a consumer that stopped early left unread data on the socket
+        if not done:
+            _drop(host)
+
+def stream_generate(url, payload, timeout=None):
+    # streamGenerateContent, collected into the shape generateContent returns;
+    # stops reading as soon as the prompt is reported blocked instead of
+    # waiting out the full response
+    events = post_sse(url, payload, timeout)
+    texts, candidate = [], None
+    try:
+        for event in events:
+            if event.get("promptFeedback", {}).get("blockReason"):
+                return event
+            for cand in event.get("candidates", [])[:1]:
+                texts.extend(part.get("text", "") for part in cand.get("content", {}).get("parts", []))
+                candidate = cand
+    finally:
+        events.close()
+    if candidate is None:
+        return {}
+    # the last chunk carries finishReason (e.g. MAX_TOKENS when output was cut off)
+    text = "".join(texts)
+    reason = candidate.get("finishReason")
+    if not text and reason not in ("STOP", "MAX_TOKENS"):
+        # stopped for SAFETY, RECITATION etc. before producing anything:
+        # report it the way a blocked prompt is reported
+        return {"promptFeedback": {"blockReason": reason or "unknown"}}
+    return {"candidates": [dict(candidate, content={"parts": [{"text": text}]})]}
+
+# statuses worth retrying: rate limited or a transient server-side failure
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# quota and overload errors rarely clear within seconds, so they get more
+# attempts and a longer backoff than other failures
+SLOW_RETRY_STATUSES = (429, 503)
+
+def retry_attempts(err, default=3):
+    return max(default, 6) if getattr(err, "code", None) in SLOW_RETRY_STATUSES else default
+
+def _server_retry_delay(err):
+    # a Retry-After header, or Gemini's google.rpc.RetryInfo in the JSON error
+    # body ({"error": {"details": [{"@type": "...RetryInfo", "retryDelay": "37s"}]}})
+    headers = getattr(err, "headers", None)
+    retry_after = headers.get("Retry-After") if headers else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    fp = getattr(err, "fp", None)
+    if not isinstance(fp, io.BytesIO):
+        return None
+    try:
+        for detail in json.loads(fp.getvalue())["error"].get("details", []):
+            if detail.get("@type", "").endswith("RetryInfo"):
+                return float(detail["retryDelay"].rstrip("s"))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return None
+
+def retry_delay(err, attempt, cap=60):
+    # the server's own hint if it gave one, else exponential backoff with
+    # jitter so concurrent workers don't all retry in lockstep
+    delay = _server_retry_delay(err)
+    if delay is not None:
+        return min(delay, cap)
+    base = 5 if getattr(err, "code", None) in SLOW_RETRY_STATUSES else 1
+    return min(cap, base * 2 ** attempt + random.random())
+
+class RateLimiter:
+    # token bucket shared by all threads: wait() blocks until a request slot
+    # is free, so we don't send calls that are sure to come back as 429s
+    def __init__(self, rpm, burst=1):
+        self.rate = rpm / 60.0
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+# requests per minute across a whole run; set GEMINI_RPM to match your quota tier
+RATE_LIMIT = RateLimiter(int(os.environ.get("GEMINI_RPM", "60")))
+# concurrent requests the report scripts keep in flight, to stay under rate limits
+BATCH_WORKERS = 5
+# severity lookups for the extracted people: SEV_RANK orders the report,
+# SEV_CMP picks the worst one on merge
+SEV_RANK = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+SEV_CMP = {"critical": 4, "high": 3, "medium": 2, "low": 1}
+
+# opt-in exact-match response cache (GEMINI_CACHE=1): rerunning a report with
+# unchanged prompts is answered from epstein.db instead of the API
+CACHE_ENABLED = os.environ.get("GEMINI_CACHE") == "1"
+CACHE_TTL = float(os.environ.get("GEMINI_CACHE_TTL", 7 * 86400))
+CACHE_DB = os.path.join(os.path.dirname(__file__), "epstein.db")
+
+def cache_key(url, payload):
+    # model from the URL path (not the method, so streamed and plain calls
+    # share entries) plus the prompt and generationConfig; the ?key= API key
+    # is deliberately left out. Prompt whitespace is collapsed so
+    # reflowing or re-indenting a prompt template still hits the cache.
+    model = urllib.parse.urlsplit(url).path.rsplit("/", 1)[-1].split(":")[0]
+    parts = [" ".join(part.get("text", "").split()) for c in payload["contents"] for part in c["parts"]]
+    key = {"m": model, "p": parts, "c": payload.get("generationConfig")}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def _cache_db():
+    conn = getattr(_local, "cache_db", None)
+    if conn is None:
+        conn = connect(CACHE_DB)
+        conn.execute("CREATE TABLE IF NOT EXISTS gemini_cache (key TEXT PRIMARY KEY, response TEXT, created REAL)")
+        _local.cache_db = conn
+    return conn
+
+def cache_get(key):
+    if not CACHE_ENABLED:
+        return None
+    row = _cache_db().execute("SELECT response, created FROM gemini_cache WHERE key = ?", (key,)).fetchone()
+    if row and time.time() - row[1] < CACHE_TTL:
+        return row[0]
+    return None
+
+def cache_put(key, response):
+    if not CACHE_ENABLED:
+        return
+    conn = _cache_db()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO gemini_cache (key, response, created) VALUES (?, ?, ?)",
+                     (key, response, time.time()))
+
+def generate_text(url, payload, timeout=120):
+    # one streamGenerateContent call the way the report scripts use it: served
+    # from the cache when possible, rate limited otherwise, None (with a note)
+    # when blocked, and only a complete STOP answer stored, never an empty or
+    # truncated one. HTTP/network errors propagate for the caller to retry.
+    key = cache_key(url, payload)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+    RATE_LIMIT.wait()
+    result = stream_generate(url, payload, timeout)
+    if "candidates" not in result:
+        print(f"  Blocked: {result.get('promptFeedback', {}).get('blockReason', 'unknown')}", flush=True)
+        return None
+    candidate = result["candidates"][0]
+    if candidate.get("finishReason") == "MAX_TOKENS":
+        print("  Output hit maxOutputTokens, may be truncated", flush=True)
+    text = candidate["content"]["parts"][0]["text"]
+    if text and candidate.get("finishReason") == "STOP":
+        cache_put(key, text)
+    return text
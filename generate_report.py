@@ -1,22 +1,20 @@
-import sqlite3, json, os, urllib.request
+import sqlite3, os
+from gemini import generate_text
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 API_KEY = os.environ.get("GEMINI_API_KEY")
 OUTPUT = os.path.join(os.path.dirname(__file__), "report.html")
 
 def call_gemini(prompt):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={API_KEY}"
-    payload = json.dumps({
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:streamGenerateContent?alt=sse&key={API_KEY}"
+    payload = {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {"temperature": 0.4, "maxOutputTokens": 8192}
-    })
-    req = urllib.request.Request(url, data=payload.encode(), headers={"Content-Type": "application/json"})
-    resp = urllib.request.urlopen(req, timeout=120)
-    result = json.loads(resp.read())
-    if "candidates" not in result:
-        print("API response:", json.dumps(result, indent=2)[:2000])
+    }
+    text = generate_text(url, payload)
+    if text is None:
         raise Exception("No candidates in response")
-    return result["candidates"][0]["content"]["parts"][0]["text"]
+    return text
 
 def main():
     if not API_KEY:
@@ -25,14 +23,14 @@ def main():
 
     conn = sqlite3.connect(DB_PATH)
     rows = conn.execute("""
-        SELECT filename, news_score, condensed, ai_summary
+        SELECT filename, news_score, ai_summary
         FROM documents WHERE news_score > 0
         ORDER BY news_score DESC LIMIT 5
-    """).fetchall()
+    """)
 
     # use AI summaries only (raw text triggers safety filters)
     context_parts = []
-    for fname, score, condensed, summary in rows:
+    for fname, score, summary in rows:
         context_parts.append(f"""
 --- DOCUMENT: {fname} (Newsworthiness: {score}/100) ---
 {summary}
@@ -1,32 +1,37 @@
-import sqlite3, json, os, urllib.request, time
+import sqlite3, json, os, time, re, urllib.error, concurrent.futures
+from db import newsworthy_batches, map_in_order
+from gemini import generate_text, retry_delay, retry_attempts, RETRY_STATUSES, BATCH_WORKERS, SEV_RANK, SEV_CMP
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 API_KEY = os.environ.get("GEMINI_API_KEY")
 OUTPUT = os.path.join(os.path.dirname(__file__), "report.html")
+# any flat JSON object in a reply that didn't parse as a whole
+RE_JSON_OBJECT = re.compile(r'\{[^{}]+\}')
 
 def call_gemini(prompt, retries=3):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={API_KEY}"
-    payload = json.dumps({
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:streamGenerateContent?alt=sse&key={API_KEY}"
+    payload = {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {"temperature": 0.4, "maxOutputTokens": 16384}
-    })
-    req = urllib.request.Request(url, data=payload.encode(), headers={"Content-Type": "application/json"})
-    for attempt in range(retries):
+    }
+    attempt = 0
+    while True:
         try:
-            resp = urllib.request.urlopen(req, timeout=120)
-            result = json.loads(resp.read())
-            if "candidates" not in result:
-                reason = result.get("promptFeedback", {}).get("blockReason", "unknown")
-                print(f"  Blocked: {reason}")
-                return None
-            return result["candidates"][0]["content"]["parts"][0]["text"]
+            return generate_text(url, payload)
         except Exception as e:
-            if "429" in str(e):
-                time.sleep(10)
-            else:
+            http_error = isinstance(e, urllib.error.HTTPError)
+            if http_error and e.code not in RETRY_STATUSES:
+                # bad request / auth: retrying won't help
+                print(f"  Error: {e}")
+                return None
+            attempt += 1
+            if attempt >= retry_attempts(e, retries):
+                # always said, so a dropped batch isn't just "found 0 people"
+                print(f"  Giving up after {attempt} attempts: {e}")
+                return None
+            if not (http_error and e.code == 429):
                 print(f"  Error: {e}")
-                time.sleep(3)
-    return None
+            time.sleep(retry_delay(e, attempt - 1))
 
 BATCH_PROMPT = """You are a legal analyst reviewing summaries of declassified DOJ Epstein case documents (public court records released under the Epstein Files Transparency Act).
 
@@ -67,67 +72,63 @@ Data:
 
 """
 
+def extract_batch(batch):
+    context = "\n".join(f"--- {fname} (score:{score}) ---\n{summary}\n" for fname, score, summary in batch)
+    result = call_gemini(BATCH_PROMPT + context)
+    if not result:
+        return []
+
+    # parse JSON — try to fix truncated output
+    try:
+        text = result.strip()
+        if text.startswith("```"):
+            text = text.split("\n", 1)[1].rsplit("```", 1)[0]
+        # try as-is first
+        try:
+            people = json.loads(text)
+        except json.JSONDecodeError:
+            # try closing truncated JSON
+            for fix in [']', '"}]', '"}]}]', '"]}]']:
+                try:
+                    people = json.loads(text + fix)
+                    break
+                except json.JSONDecodeError:
+                    continue
+            else:
+                # extract individual objects with regex
+                objects = RE_JSON_OBJECT.findall(text)
+                people = []
+                for obj in objects:
+                    try:
+                        p = json.loads(obj)
+                        if "name" in p:
+                            people.append(p)
+                    except json.JSONDecodeError:
+                        pass
+        return people
+    except Exception as e:
+        print(f"    Parse error: {e}")
+        return []
+
 def main():
     if not API_KEY:
         print("ERROR: GEMINI_API_KEY not set")
         return
 
     conn = sqlite3.connect(DB_PATH)
-    rows = conn.execute("""
-        SELECT filename, news_score, ai_summary
-        FROM documents WHERE ai_summary != '' AND news_score >= 50
-        ORDER BY news_score DESC
-    """).fetchall()
-    print(f"Processing {len(rows)} documents in batches...")
-
-    # batch into groups of 20
-    all_people = []
     batch_size = 10
-    for i in range(0, len(rows), batch_size):
-        batch = rows[i:i+batch_size]
-        context = "\n".join(f"--- {fname} (score:{score}) ---\n{summary}\n" for fname, score, summary in batch)
-
-        print(f"  Batch {i//batch_size + 1}/{(len(rows)-1)//batch_size + 1} ({len(batch)} docs)...")
-        result = call_gemini(BATCH_PROMPT + context)
-        if not result:
-            continue
+    total, unique, batches = newsworthy_batches(conn, batch_size)
+    print(f"Processing {total} documents ({unique} unique summaries) in batches...")
 
-        # parse JSON — try to fix truncated output
-        try:
-            text = result.strip()
-            if text.startswith("```"):
-                text = text.split("\n", 1)[1].rsplit("```", 1)[0]
-            # try as-is first
-            try:
-                people = json.loads(text)
-            except:
-                # try closing truncated JSON
-                for fix in [']', '"}]', '"}]}]', '"]}]']:
-                    try:
-                        people = json.loads(text + fix)
-                        break
-                    except:
-                        continue
-                else:
-                    # extract individual objects with regex
-                    import re
-                    objects = re.findall(r'\{[^{}]+\}', text)
-                    people = []
-                    for obj in objects:
-                        try:
-                            p = json.loads(obj)
-                            if "name" in p:
-                                people.append(p)
-                        except:
-                            pass
+    all_people = []
+    n_batches = (unique + batch_size - 1) // batch_size
+    with concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_WORKERS) as pool:
+        for n, people in enumerate(map_in_order(pool, extract_batch, batches, 2 * BATCH_WORKERS)):
             all_people.extend(people)
-            print(f"    Found {len(people)} people")
-        except Exception as e:
-            print(f"    Parse error: {e}")
-
-        time.sleep(2)
+            print(f"  Batch {n+1}/{n_batches}: found {len(people)} people")
 
-    # deduplicate by name
+    # deduplicate by name; allegations/sources accumulate in dicts used as
+    # ordered sets, so each merge is O(new items) and keeps first-seen order
     merged = {}
     for p in all_people:
         name = p.get("name", "").strip()
@@ -135,16 +136,19 @@ def main():
             continue
         key = name.lower()
         if key in merged:
-            merged[key]["allegations"] = list(set(merged[key]["allegations"] + p.get("allegations", [])))
-            merged[key]["sources"] = list(set(merged[key]["sources"] + p.get("sources", [])))
+            merged[key]["allegations"].update(dict.fromkeys(p.get("allegations", [])))
+            merged[key]["sources"].update(dict.fromkeys(p.get("sources", [])))
             # keep highest severity
-            sev_order = {"critical": 4, "high": 3, "medium": 2, "low": 1}
-            if sev_order.get(p.get("severity", "low"), 0) > sev_order.get(merged[key]["severity"], 0):
+            if SEV_CMP.get(p.get("severity", "low"), 0) > SEV_CMP.get(merged[key]["severity"], 0):
                 merged[key]["severity"] = p["severity"]
         else:
-            merged[key] = p
+            merged[key] = dict(p, allegations=dict.fromkeys(p.get("allegations", [])),
+                               sources=dict.fromkeys(p.get("sources", [])))
+    for m in merged.values():
+        m["allegations"] = list(m["allegations"])
+        m["sources"] = list(m["sources"])
 
-    people_list = sorted(merged.values(), key=lambda p: {"critical": 0, "high": 1, "medium": 2, "low": 3}.get(p.get("severity", "low"), 4))
+    people_list = sorted(merged.values(), key=lambda p: SEV_RANK.get(p.get("severity", "low"), 4))
     print(f"\nTotal unique people: {len(people_list)}")
 
     # render HTML
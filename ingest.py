@@ -1,7 +1,11 @@
-import os, sys, sqlite3, fitz, glob
+import os, sys, fitz
+from concurrent.futures import ProcessPoolExecutor
+from db import connect, map_in_order
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 BASE_DIR = os.path.dirname(__file__)
+# extracted-but-unwritten PDFs held at once, per worker process
+EXTRACT_AHEAD = 4
 
 def init_db(conn):
     conn.execute("""CREATE TABLE IF NOT EXISTS documents (
@@ -9,7 +13,6 @@ def init_db(conn):
         filename TEXT UNIQUE,
         filepath TEXT,
         page_count INTEGER,
-        full_text TEXT,
         bates_start TEXT,
         bates_end TEXT
     )""")
@@ -19,10 +22,21 @@ def init_db(conn):
         page_num INTEGER,
         text TEXT
     )""")
-    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(filename, page_num, text)")
-    conn.execute("""CREATE TRIGGER IF NOT EXISTS pages_ai AFTER INSERT ON pages BEGIN
-        INSERT INTO search(rowid, filename, page_num, text)
-        SELECT new.id, d.filename, new.page_num, new.text FROM documents d WHERE d.id = new.doc_id;
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_doc ON pages(doc_id, page_num)")
+    # older dbs have a standalone fts5(filename, page_num, text) table, which
+    # IF NOT EXISTS would keep (and snippet() column 0 would be filename):
+    # swap it for the external-content one and rebuild it from pages
+    old = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'search'").fetchone()
+    stale = old is not None and "content='pages'" not in old[0]
+    if stale:
+        conn.execute("DROP TABLE search")
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(text, content='pages', content_rowid='id')")
+    if stale:
+        conn.execute("INSERT INTO search(search) VALUES('rebuild')")
+    # recreated every run so older dbs pick up the current search columns
+    conn.execute("DROP TRIGGER IF EXISTS pages_ai")
+    conn.execute("""CREATE TRIGGER pages_ai AFTER INSERT ON pages BEGIN
+        INSERT INTO search(rowid, text) VALUES (new.id, new.text);
     END""")
     conn.commit()
 
@@ -31,61 +45,96 @@ def parse_dat(dat_path):
     if not os.path.exists(dat_path):
         return bates
     with open(dat_path, "r", encoding="utf-8", errors="replace") as f:
-        lines = f.readlines()
-    for line in lines[1:]:
-        parts = line.strip().split("þ")
-        parts = [p for p in parts if p]
+        data = f.read()
+    # split on "\n" like readlines did: splitlines() would also break on the
+    # \x1c-\x1e control characters Concordance load files can contain
+    lines = iter(data.split("\n"))
+    next(lines, None)  # header row
+    for line in lines:
+        parts = list(filter(None, line.strip().split("þ")))
         if len(parts) >= 2:
-            bates[parts[0]] = parts[1] if len(parts) > 1 else ""
+            bates[parts[0]] = parts[1]
     return bates
 
+def extract_pdf(pdf_path):
+    # worker process: pull every page's text, no db access
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        return pdf_path, None, str(e)
+    pages_text = [page.get_text() for page in doc]
+    doc.close()
+    return pdf_path, pages_text, None
+
+def find_inputs(base):
+    # one walk for both the .DAT load files and the PDFs, matching what the two
+    # recursive globs did: case-sensitive suffixes, hidden entries skipped,
+    # symlinked dirs followed, paths relative when base is ""
+    dats, pdfs = [], []
+    for root, dirs, files in os.walk(base or os.curdir, followlinks=True):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        if not base:
+            root = os.path.relpath(root)
+            root = "" if root == os.curdir else root
+        for name in files:
+            if name.startswith("."):
+                continue
+            if name.endswith(".DAT"):
+                dats.append(os.path.join(root, name))
+            elif name.endswith(".pdf"):
+                pdfs.append(os.path.join(root, name))
+    return dats, pdfs
+
 def ingest():
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
     init_db(conn)
 
+    dats, pdfs = find_inputs(BASE_DIR)
     bates_map = {}
-    for dat in glob.glob(os.path.join(BASE_DIR, "**", "*.DAT"), recursive=True):
+    for dat in sorted(dats):
         bates_map.update(parse_dat(dat))
 
-    pdfs = glob.glob(os.path.join(BASE_DIR, "**", "*.pdf"), recursive=True)
     print(f"Found {len(pdfs)} PDFs")
 
+    # only new files go to the workers; a repeated filename keeps its first path
+    known = {row[0] for row in conn.execute("SELECT filename FROM documents")}
+    new_pdfs = []
     for pdf_path in sorted(pdfs):
         filename = os.path.basename(pdf_path)
-        existing = conn.execute("SELECT id FROM documents WHERE filename=?", (filename,)).fetchone()
-        if existing:
+        if filename in known:
             print(f"  skip {filename} (already indexed)")
             continue
+        known.add(filename)
+        new_pdfs.append(pdf_path)
 
-        try:
-            doc = fitz.open(pdf_path)
-        except Exception as e:
-            print(f"  ERROR opening {filename}: {e}")
-            continue
-
-        pages_text = []
-        full_text_parts = []
-        for i in range(len(doc)):
-            text = doc[i].get_text()
-            pages_text.append(text)
-            full_text_parts.append(text)
-
-        bates_start = filename.replace(".pdf", "")
-        bates_end = bates_map.get(bates_start, "")
+    # text extraction is CPU-bound, so it runs across processes while this one
+    # stays the only sqlite writer; results come back in sorted insert order,
+    # and only a few per worker wait on the writer, so a large run never holds
+    # the whole corpus's text in memory
+    workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as ex:
+        results = map_in_order(ex, extract_pdf, new_pdfs, EXTRACT_AHEAD * workers)
+        for pdf_path, pages_text, error in results:
+            filename = os.path.basename(pdf_path)
+            if error:
+                print(f"  ERROR opening {filename}: {error}")
+                continue
 
-        conn.execute(
-            "INSERT INTO documents (filename, filepath, page_count, full_text, bates_start, bates_end) VALUES (?,?,?,?,?,?)",
-            (filename, pdf_path, len(doc), "\n".join(full_text_parts), bates_start, bates_end)
-        )
-        doc_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            bates_start = filename.replace(".pdf", "")
+            bates_end = bates_map.get(bates_start, "")
 
-        for i, text in enumerate(pages_text):
-            conn.execute("INSERT INTO pages (doc_id, page_num, text) VALUES (?,?,?)", (doc_id, i + 1, text))
+            # one transaction per document: its row and pages land together, and an
+            # interrupted run resumes at the next file instead of losing everything
+            with conn:
+                doc_id = conn.execute(
+                    "INSERT INTO documents (filename, filepath, page_count, bates_start, bates_end) VALUES (?,?,?,?,?)",
+                    (filename, pdf_path, len(pages_text), bates_start, bates_end)
+                ).lastrowid
+                conn.executemany("INSERT INTO pages (doc_id, page_num, text) VALUES (?,?,?)",
+                                 ((doc_id, i + 1, text) for i, text in enumerate(pages_text)))
 
-        print(f"  indexed {filename} ({len(doc)} pages)")
-        doc.close()
+            print(f"  indexed {filename} ({len(pages_text)} pages)")
 
-    conn.commit()
     total = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
     pages = conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
     print(f"\nDone: {total} documents, {pages} pages indexed")
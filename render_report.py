@@ -1,29 +1,37 @@
 """Render the report HTML directly from DB data — no Gemini needed for this step."""
-import sqlite3, json, os, urllib.request, time, re
+import sqlite3, json, os, time, re, urllib.error, concurrent.futures
+from html import escape
+from db import newsworthy_batches, map_in_order
+from gemini import generate_text, retry_delay, retry_attempts, RETRY_STATUSES, BATCH_WORKERS, SEV_RANK, SEV_CMP
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "epstein.db")
 API_KEY = os.environ.get("GEMINI_API_KEY")
 OUTPUT = os.path.join(os.path.dirname(__file__), "report.html")
+# a flat JSON object long enough to be a person (skips stray {} fragments),
+# for salvaging people from unparseable output
+RE_JSON_OBJECT = re.compile(r'\{[^{}]{20,}\}')
 
 def call_gemini(prompt):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={API_KEY}"
-    payload = json.dumps({
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:streamGenerateContent?alt=sse&key={API_KEY}"
+    payload = {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {"temperature": 0.3, "maxOutputTokens": 16384}
-    })
-    req = urllib.request.Request(url, data=payload.encode(), headers={"Content-Type": "application/json"})
-    for attempt in range(3):
+    }
+    attempt = 0
+    while True:
         try:
-            resp = urllib.request.urlopen(req, timeout=120)
-            result = json.loads(resp.read())
-            if "candidates" not in result:
-                flush(f"  Blocked: {result.get('promptFeedback', {}).get('blockReason', '?')}")
-                return None
-            return result["candidates"][0]["content"]["parts"][0]["text"]
+            return generate_text(url, payload)
         except Exception as e:
-            flush(f"  Retry {attempt+1}: {e}")
-            time.sleep(5)
-    return None
+            if isinstance(e, urllib.error.HTTPError) and e.code not in RETRY_STATUSES:
+                # bad request / auth: retrying won't help
+                flush(f"  Error: {e}")
+                return None
+            attempt += 1
+            if attempt >= retry_attempts(e):
+                flush(f"  Giving up after {attempt} attempts: {e}")
+                return None
+            flush(f"  Retry {attempt}: {e}")
+            time.sleep(retry_delay(e, attempt - 1))
 
 def extract_people_from_batch(summaries_text):
     prompt = """From these DOJ document summaries, extract named PUBLIC FIGURES only (politicians, billionaires, celebrities, executives — NOT lawyers, agents, or unnamed victims).
@@ -41,6 +49,10 @@ Summaries:
 """ + summaries_text
     return call_gemini(prompt)
 
+def extract_batch(batch):
+    context = "\n".join(f"--- {f} (score:{s}) ---\n{summary}\n" for f, s, summary in batch)
+    return parse_json_loose(extract_people_from_batch(context))
+
 def parse_json_loose(text):
     if not text:
         return []
@@ -50,26 +62,28 @@ def parse_json_loose(text):
     # try full parse
     try:
         return json.loads(text)
-    except:
+    except json.JSONDecodeError:
         pass
     # try closing brackets
     for fix in [']', '"}]', '"]}]', '"]}}]']:
         try:
             return json.loads(text + fix)
-        except:
+        except json.JSONDecodeError:
             pass
     # extract objects
     results = []
-    for m in re.finditer(r'\{[^{}]{20,}\}', text):
+    for m in RE_JSON_OBJECT.finditer(text):
         try:
             obj = json.loads(m.group())
             if "name" in obj:
                 results.append(obj)
-        except:
+        except json.JSONDecodeError:
             pass
     return results
 
 def merge_people(all_people):
+    # allegations/sources accumulate in dicts used as ordered sets, so each
+    # merge is O(new items) and the result keeps first-seen order
     merged = {}
     for p in all_people:
         name = p.get("name", "").strip()
@@ -77,10 +91,9 @@ def merge_people(all_people):
             continue
         key = name.lower()
         if key in merged:
-            merged[key]["allegations"] = list(set(merged[key]["allegations"] + p.get("allegations", [])))
-            merged[key]["sources"] = list(set(merged[key]["sources"] + p.get("sources", [])))
-            sev = {"critical": 4, "high": 3, "medium": 2, "low": 1}
-            if sev.get(p.get("severity", "low"), 0) > sev.get(merged[key]["severity"], 0):
+            merged[key]["allegations"].update(dict.fromkeys(p.get("allegations", [])))
+            merged[key]["sources"].update(dict.fromkeys(p.get("sources", [])))
+            if SEV_CMP.get(p.get("severity", "low"), 0) > SEV_CMP.get(merged[key]["severity"], 0):
                 merged[key]["severity"] = p["severity"]
                 merged[key]["role"] = p.get("role", merged[key].get("role", ""))
         else:
@@ -88,44 +101,52 @@ def merge_people(all_people):
                 "name": name,
                 "role": p.get("role", ""),
                 "severity": p.get("severity", "low"),
-                "allegations": p.get("allegations", []),
-                "sources": p.get("sources", [])
+                "allegations": dict.fromkeys(p.get("allegations", [])),
+                "sources": dict.fromkeys(p.get("sources", []))
             }
-    return sorted(merged.values(), key=lambda x: {"critical": 0, "high": 1, "medium": 2, "low": 3}.get(x["severity"], 4))
+    for m in merged.values():
+        m["allegations"] = list(m["allegations"])
+        m["sources"] = list(m["sources"])
+    return sorted(merged.values(), key=lambda x: SEV_RANK.get(x["severity"], 4))
 
 def render_html(people):
     sev_colors = {"critical": "#da3633", "high": "#f0883e", "medium": "#8b949e", "low": "#484f58"}
     sev_labels = {"critical": "CRITICAL", "high": "HIGH", "medium": "MEDIUM", "low": "LOW"}
 
-    toc = ""
-    sections = ""
+    # collect the pieces and join once instead of growing strings with +=
+    toc_parts = []
+    section_parts = []
     for i, p in enumerate(people):
         color = sev_colors.get(p["severity"], "#484f58")
         label = sev_labels.get(p["severity"], "LOW")
         pid = f"person-{i}"
+        # names, roles, allegations and sources are model output: escape each
+        # once so stray <, & or quotes can't break (or inject into) the page
+        name = escape(p["name"])
+        role = escape(str(p["role"]))
 
-        toc += f'<li><a href="#{pid}" style="color:{color}">{p["name"]}</a> <span style="color:{color};font-size:11px">({label})</span></li>\n'
+        toc_parts.append(f'<li><a href="#{pid}" style="color:{color}">{name}</a> <span style="color:{color};font-size:11px">({label})</span></li>\n')
 
-        allegations_html = ""
-        for a in p["allegations"]:
-            allegations_html += f'<li>{a}</li>\n'
+        allegations_html = "".join(f'<li>{escape(str(a))}</li>\n' for a in p["allegations"])
 
-        sources_html = ", ".join(p.get("sources", []))
+        sources_html = ", ".join(escape(str(s)) for s in p.get("sources", []))
 
-        sections += f"""
+        section_parts.append(f"""
 <div class="person-section" id="{pid}">
     <div class="person-header" style="border-left: 4px solid {color}; padding-left: 16px; margin-bottom: 16px;">
-        <h3 style="color:{color}; margin:0; font-size:20px;">{p["name"]}
+        <h3 style="color:{color}; margin:0; font-size:20px;">{name}
             <span style="background:{color}; color:#fff; padding:2px 8px; border-radius:10px; font-size:11px; margin-left:8px; vertical-align:middle;">{label}</span>
         </h3>
-        <div style="color:#8b949e; font-size:13px; margin-top:4px;">{p["role"]}</div>
+        <div style="color:#8b949e; font-size:13px; margin-top:4px;">{role}</div>
     </div>
     <ul style="line-height:1.8; margin-bottom:12px;">
         {allegations_html}
     </ul>
     <div style="color:#484f58; font-size:12px;">Sources: {sources_html}</div>
 </div>
-"""
+""")
+    toc = "".join(toc_parts)
+    sections = "".join(section_parts)
 
     return f"""<!DOCTYPE html>
 <html lang="en">
@@ -180,25 +201,16 @@ def main():
         return
 
     conn = sqlite3.connect(DB_PATH)
-    rows = conn.execute("""
-        SELECT filename, news_score, ai_summary
-        FROM documents WHERE ai_summary != '' AND news_score >= 50
-        ORDER BY news_score DESC
-    """).fetchall()
-    flush(f"Processing {len(rows)} documents...")
+    batch_size = 10
+    total, unique, batches = newsworthy_batches(conn, batch_size)
+    flush(f"Processing {total} documents ({unique} unique summaries)...")
 
     all_people = []
-    batch_size = 10
-    for i in range(0, len(rows), batch_size):
-        batch = rows[i:i+batch_size]
-        context = "\n".join(f"--- {f} (score:{s}) ---\n{summary}\n" for f, s, summary in batch)
-        flush(f"  Batch {i//batch_size + 1}/{(len(rows)-1)//batch_size + 1}...")
-
-        result = extract_people_from_batch(context)
-        people = parse_json_loose(result)
-        all_people.extend(people)
-        flush(f"    Extracted {len(people)} people")
-        time.sleep(2)
+    n_batches = (unique + batch_size - 1) // batch_size
+    with concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_WORKERS) as pool:
+        for n, people in enumerate(map_in_order(pool, extract_batch, batches, 2 * BATCH_WORKERS)):
+            all_people.extend(people)
+            flush(f"  Batch {n+1}/{n_batches}: extracted {len(people)} people")
 
     people = merge_people(all_people)
     flush(f"\nTotal unique public figures: {len(people)}")